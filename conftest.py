@@ -0,0 +1,145 @@
+from contextlib import ExitStack
+from functools import lru_cache
+import json
+import os
+from urllib.parse import parse_qs, urlparse
+
+from peewee import SqliteDatabase
+import pytest
+from requests import Response
+from requests.adapters import BaseAdapter
+
+from functions import create_session, json_loads
+from models import Cryptocurrency, HistoricalValue
+import settings
+
+MODELS = [Cryptocurrency, HistoricalValue]
+TEST_DATA_FILE = 't_data.json'
+
+# SQLite database for tests, it is discarded so durability is not needed
+db = SqliteDatabase(':memory:', pragmas={'journal_mode': 'memory',
+                                         'synchronous': 'off',
+                                         'locking_mode': 'exclusive',
+                                         'temp_store': 'memory',
+                                         'cache_size': -8000})
+
+
+@lru_cache(maxsize=1)
+def load_test_data():
+    """Read and decode the testing data only once."""
+    with open(TEST_DATA_FILE, 'rb') as f:
+        return json_loads(f.read())
+
+
+@pytest.fixture(scope='session')
+def test_db():
+    """Set up the database and add testing data once per test session."""
+    db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    db.connect()
+    db.create_tables(MODELS)
+
+    try:
+        data = load_test_data()
+    except FileNotFoundError:
+        pytest.exit(f'{TEST_DATA_FILE} file is missing')
+
+    # Testing data need no conversion, so rows are inserted without peewee
+    fields = list(data[0])
+    columns = [HistoricalValue.currency.column_name] + [
+        getattr(HistoricalValue, field).column_name for field in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        HistoricalValue._meta.table_name, ', '.join(columns),
+        ', '.join('?' * len(columns)))
+    with db.atomic():
+        c = Cryptocurrency.create(currency_name='btc-bitcoin')
+        db.cursor().executemany(
+            sql, [(c.id, *(elem[f] for f in fields)) for elem in data])
+
+    yield db
+    db.drop_tables(MODELS)
+    db.close()
+
+
+@pytest.fixture
+def tmp_cwd(tmp_path, monkeypatch):
+    """Run a test in a temporary directory, removed by pytest later.
+
+    The database path is made absolute first, so the application can
+    still find its database from there.
+    """
+    parameters = settings.DATABASE['parameters']
+    path = os.path.abspath(parameters['path'])
+    monkeypatch.setitem(parameters, 'path', path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def transaction(test_db):
+    """Roll back any changes made to the database by a single test."""
+    with test_db.atomic() as txn:
+        yield test_db
+        txn.rollback()
+
+
+class FakeApiAdapter(BaseAdapter):
+    """Serve API responses from the testing data instead of the network.
+
+    Historical values are filtered by the start and end query
+    parameters and get the time_close key sent by the API. Any other
+    URL returns the cryptocurrency it ends with. Requests for windows
+    starting on one of the failing_starts dates get a server error.
+    """
+
+    def __init__(self, failing_starts=()):
+        super(FakeApiAdapter, self).__init__()
+        self.failing_starts = frozenset(failing_starts)
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        response = Response()
+        response.url = request.url
+        response.request = request
+        if url.path.endswith('/historical'):
+            query = parse_qs(url.query)
+            start, end = query['start'][0], query['end'][0]
+            if start in self.failing_starts:
+                response.status_code = 500
+                response.reason = 'Internal Server Error'
+                response._content = b'{}'
+                return response
+            body = [dict(row, time_close=row['date'] + 'T23:59:59Z')
+                    for row in load_test_data()
+                    if start <= row['date'] <= end]
+        else:
+            body = {'id': url.path.rsplit('/', 1)[-1]}
+
+        response.status_code = 200
+        response._content = json.dumps(body).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_api_session():
+    """Create HTTP sessions answered by FakeApiAdapter for a single test.
+
+    The returned function takes the failing_starts of the adapter.
+    """
+    with ExitStack() as stack:
+        def create(failing_starts=()):
+            session = stack.enter_context(create_session())
+            session.mount('https://', FakeApiAdapter(failing_starts))
+            return session
+
+        yield create
+
+
+@pytest.fixture(scope='session')
+def http_session():
+    """Share one HTTP session between tests, answered by FakeApiAdapter."""
+    with create_session() as session:
+        session.mount('https://', FakeApiAdapter())
+        yield session
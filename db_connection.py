@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 import os
 
 from peewee import SqliteDatabase
@@ -5,21 +6,63 @@ from peewee import SqliteDatabase
 from settings import DATABASE
 
 
+def sqlite_connection(path, filename):
+    """Prepare a connection to the selected SQLite database.
+
+    The database uses write-ahead logging, which requires the file
+    to be stored on a local file system. A locked database is retried
+    for up to 30 seconds before an error is raised.
+    """
+    return SqliteDatabase(database=os.path.join(path, filename), timeout=30,
+                          pragmas={'foreign_keys': 1,
+                                   'journal_mode': 'wal',
+                                   'synchronous': 'normal',
+                                   'cache_size': -64000,
+                                   'temp_store': 'memory',
+                                   'mmap_size': 268435456})
+
+
 class DatabaseConnection:
     """Connect to the database.
 
     The connection method is selected based on the DATABASE
-    setting in settings.py file.
+    setting in settings.py file. The database object is created
+    once and then shared by all callers.
     """
 
+    _connectors = {'sqlite_connection': sqlite_connection}
+    _instances = {}
+
     @classmethod
     def connect(cls):
         """Connect and return the database object."""
-        connection = getattr(cls, DATABASE['connection'])
-        return connection(**DATABASE['parameters'])
-
-    @staticmethod
-    def sqlite_connection(path, filename):
-        """Prepare a connection to the selected SQLite database."""
-        return SqliteDatabase(database=os.path.join(path, filename),
-                              pragmas={'foreign_keys': 1})
+        key = (DATABASE['connection'],
+               frozenset(DATABASE['parameters'].items()))
+        if key not in cls._instances:
+            connection = cls._connectors[DATABASE['connection']]
+            cls._instances[key] = connection(**DATABASE['parameters'])
+        return cls._instances[key]
+
+
+@contextmanager
+def connection(db):
+    """Keep the connection open, close it only if it was opened here."""
+    opened = db.connect(reuse_if_open=True)
+    try:
+        yield db
+    finally:
+        if opened:
+            db.close()
+
+
+@contextmanager
+def pragmas(db, values):
+    """Temporarily change pragmas of the open connection."""
+    previous = {name: db.pragma(name) for name in values}
+    for name, value in values.items():
+        db.pragma(name, value)
+    try:
+        yield db
+    finally:
+        for name, value in previous.items():
+            db.pragma(name, value)
@@ -1,17 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from datetime import datetime, timedelta
 from decimal import Decimal
+from fractions import Fraction
+from functools import cached_property, lru_cache, partial, wraps
 from importlib import import_module
+from itertools import groupby
 import json
-import requests
-from statistics import mean
 from string import Template
 import sys
 
+from peewee import ForeignKeyField, chunked
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
 from models import Cryptocurrency, HistoricalValue
-from db_connection import DatabaseConnection
+from db_connection import DatabaseConnection, connection, pragmas
 import settings
 
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def add_new_key(func):
+    """Add new key-value pair to the dictionary."""
+
+    @wraps(func)
+    def wrapper(self, dict_obj, dict_key, new_key, *args):
+        value = func(self, dict_obj, dict_key, *args)
+        if value is None:
+            return False
+        dict_obj[new_key] = value
+        return True
+
+    return wrapper
+
 
 class ApiDataContainer:
     """Store data received from API."""
@@ -33,11 +61,14 @@ class ApiDataContainer:
 class ApiDataDownloader(ApiDataContainer):
     """Download data from API."""
 
-    def __init__(self, url, parameters, timeout=5):
+    def __init__(self, url, parameters, timeout=5,
+                 max_workers=settings.CONCURRENT_REQUESTS, session=None):
         super(ApiDataDownloader, self).__init__()
         self.__api_url = url
         self.__parameters = parameters
         self.__timeout = timeout
+        self.__max_workers = max_workers
+        self.__session = session
         self.__error = None
 
     @property
@@ -46,36 +77,70 @@ class ApiDataDownloader(ApiDataContainer):
         return self.__error
 
     def get_data(self):
-        """Send all requests to the API and gather data."""
-        api_data = []
-        with requests.Session() as s:
-            for parameter_dict in self.__parameters:
-                data = self._send_request(s, parameter_dict)
-                if data is None:
-                    break
-                if isinstance(data, list):
-                    api_data += data
-                else:
-                    api_data.append(data)
-            else:
-                self._data = api_data
+        """Send all requests to the API concurrently and gather data.
+
+        The data are stored only if every request has succeeded.
+        """
+        chunks = list(self.iter_data())
+        if self.__error is None:
+            self._data = [item for chunk in chunks for item in chunk]
+
+    def iter_data(self):
+        """Yield a list with the data of each response once it arrives.
+
+        Requests are sent concurrently, responses are yielded in the order
+        of parameters. Iteration stops at the first failed request, with
+        the error set. A new session is created for the requests unless
+        one has been given.
+        """
+        if self.__session is not None:
+            yield from self._fetch_all(self.__session)
+        else:
+            with create_session() as s:
+                yield from self._fetch_all(s)
+
+    def _fetch_all(self, session):
+        """Send the requests concurrently using the given session."""
+        parameters = list(self.__parameters)
+        send = partial(self._send_request, session)
+        # A single request is sent directly, without starting a thread pool
+        if len(parameters) < 2:
+            yield from self._chunks(map(send, parameters))
+            return
+        workers = max(1, min(self.__max_workers, len(parameters)))
+        with ThreadPoolExecutor(workers) as executor:
+            yield from self._chunks(executor.map(send, parameters))
+
+    def _chunks(self, responses):
+        """Yield the data of each response as a list, stop at a failure.
+
+        The error is set here, in parameter order, so it always belongs
+        to the request that stopped the iteration.
+        """
+        for data, error in responses:
+            if error is not None:
+                self.__error = error
+                return
+            yield data if isinstance(data, list) else [data]
 
     def _send_request(self, session, params):
-        """Send a request using the given session and parameters."""
+        """Send a request using the given session and parameters.
+
+        Return a (data, error) tuple, one of them is None.
+        """
         try:
             response = session.get(self.__api_url, params=params,
                                    timeout=self.__timeout)
             response.raise_for_status()
         except requests.exceptions.HTTPError as err:
-            self.__error = f'HTTP Error: {err}'
+            return None, f'HTTP Error: {err}'
         except requests.exceptions.Timeout as err:
-            self.__error = f'Timeout Error: {err}'
+            return None, f'Timeout Error: {err}'
         except requests.exceptions.ConnectionError as err:
-            self.__error = f'Connection Error: {err}'
+            return None, f'Connection Error: {err}'
         except requests.exceptions.RequestException as err:
-            self.__error = f'Request Error: {err}'
-        else:
-            return response.json()
+            return None, f'Request Error: {err}'
+        return json_loads(response.content), None
 
 
 class ApiDataModifier(ApiDataContainer):
@@ -83,42 +148,23 @@ class ApiDataModifier(ApiDataContainer):
 
     def __init__(self, data, modifications):
         super(ApiDataModifier, self).__init__(data)
-        self.__modifications = modifications
-
-    class _Decorators:
-        """Decorators for ApiDataModifier methods."""
-
-        @classmethod
-        def add_new_key(cls, func):
-            """Add new key-value pair to the dictionary"""
-
-            def wrapper(self, dict_obj, dict_key, new_key, *args):
-                value = func(self, dict_obj, dict_key, *args)
-                if value is None:
-                    return False
-                dict_obj[new_key] = value
-                return True
-
-            return wrapper
+        # Resolve the methods once instead of for every row
+        self.__pipeline = [(getattr(self, modification['function']),
+                            tuple(modification['args']))
+                           for modification in modifications]
 
     def make_modifications(self):
         """Perform the required data modifications."""
         for data_dict in self._data:
-            for modification in self.__modifications:
-                method = getattr(self, modification['function'])
-                method(data_dict, *modification['args'])
-
-    @_Decorators.add_new_key
-    def _format_date(self, dict_obj, key, in_format, out_format):
-        """Return the date in the specified format."""
-        date_string = dict_obj.get(key)
-        try:
-            d = to_datetime(date_string, in_format)
-        except (ValueError, TypeError):
-            return None
-        return to_string(d, out_format)
+            for method, args in self.__pipeline:
+                method(data_dict, *args)
+
+    @add_new_key
+    def _parse_date(self, dict_obj, key, in_format):
+        """Return the date object parsed with the specified format."""
+        return _to_date(dict_obj.get(key), in_format)
 
-    @_Decorators.add_new_key
+    @add_new_key
     def _rename(self, dict_obj, key):
         """Assign the value of the existing key to the new one."""
         return dict_obj[key]
@@ -132,43 +178,54 @@ class ApiDataSave(ApiDataContainer):
         self.__db = db
         self.__table = table
         self.__foreign_keys = foreign_keys
-        self.__models_file = models
+        self.__cls = _resolve_model(models, table)
 
     def save_data(self):
-        """Save all data to the database."""
-        saved_objects = []
-        columns = self._get_columns()
-        for data_dict in self._data:
-            obj = self._save_object(data_dict, columns)
-            saved_objects.append(obj)
-        return saved_objects
+        """Save all data to the database in a single transaction.
 
-    def _save_object(self, data_dict, columns):
-        """Create and save a new object to the database."""
+        Rows are inserted in batches small enough to respect the SQLite
+        variables limit. Rows are written to the database the model is
+        bound to. Return the range of primary keys of the saved rows,
+        which are consecutive within a single transaction.
+        """
+        model_db = self.__cls._meta.database
+        with connection(self.__db), model_db.atomic():
+            columns = self._get_columns()
+            rows = [self._prepare_row(data_dict, columns)
+                    for data_dict in self._data]
+            if not rows:
+                return range(0)
+            batch_size = max(1, settings.SQLITE_MAX_VARIABLES // len(rows[0]))
+            for batch in chunked(rows, batch_size):
+                # A multi-row insert returns the row count, not the last id
+                cursor = model_db.execute(self.__cls.insert_many(batch))
+                last_id = model_db.last_insert_id(cursor)
+        return range(last_id - len(rows) + 1, last_id + 1)
+
+    def _prepare_row(self, data_dict, columns):
+        """Prepare a single row to be inserted into the database."""
         dataset = {column: data_dict[column] for column in columns}
         if self.__foreign_keys:
             dataset.update(self.__foreign_keys)
-        cls = getattr(import_module(self.__models_file), self.__table)
-        with self.__db:
-            return cls.create(**dataset)
+        return dataset
 
     def _get_columns(self):
         """Get a list of columns for the selected table.
 
-        Exclude id and any foreign key fields.
+        Columns are taken from the model, excluding id and any foreign
+        key fields, so the database is not queried.
         """
-        with self.__db:
-            fk = [i.column for i in self.__db.get_foreign_keys(self.__table)]
-            columns = [c.name for c in self.__db.get_columns(self.__table) if
-                       c.name != 'id' and c.name not in fk]
-        return columns
+        return [field.column_name for field in self.__cls._meta.sorted_fields
+                if field.name != 'id'
+                and not isinstance(field, ForeignKeyField)]
 
 
 class ApiWorker:
     """Download, modify and save the required API data."""
 
     def __init__(self, db, url, parameters, modifications, table,
-                 foreign_keys, selection=None, reject_values=None):
+                 foreign_keys, selection=None, reject_values=None,
+                 session=None):
         self.__db = db
         self.__url = url
         self.__parameters = parameters
@@ -176,7 +233,9 @@ class ApiWorker:
         self.__table = table
         self.__foreign_keys = foreign_keys
         self.__selection = selection
-        self.__reject_values = reject_values
+        self.__reject_values = (frozenset(reject_values)
+                                if reject_values is not None else None)
+        self.__session = session
 
     def data_one_to_many_or_no_relationship(self):
         """Prepare and save data.
@@ -184,23 +243,39 @@ class ApiWorker:
         Data can be saved to the database with one to many
         relationship or with no relationship at all. In the latter
         case, foreign_keys object attribute has to be set to None.
+        The database connection stays open for the whole run.
         """
-        downloader = ApiDataDownloader(self.__url, self.__parameters)
-        downloader.get_data()
-        if downloader.data is None:
-            error = downloader.error
-            return None, error
+        with connection(self.__db):
+            return self._download_and_save()
 
-        modifier = ApiDataModifier(downloader.data, self.__modifications)
-        modifier.make_modifications()
-        if self.__selection:
-            data = self._select_data(data=downloader.data)
-            downloader.data = data
+    def _download_and_save(self):
+        """Download, modify and save the data.
 
-        save_obj = ApiDataSave(downloader.data, self.__db, self.__table,
+        Each response is modified while the remaining ones are still being
+        downloaded. The data are saved in a single transaction only after
+        every request has succeeded, so the database is not locked while
+        waiting for the API.
+        """
+        downloader = ApiDataDownloader(self.__url, self.__parameters,
+                                       session=self.__session)
+        data = []
+        for chunk in downloader.iter_data():
+            data.extend(self._modify_chunk(chunk))
+        if downloader.error is not None:
+            return None, downloader.error
+
+        save_obj = ApiDataSave(data, self.__db, self.__table,
                                self.__foreign_keys)
         return save_obj.save_data(), None
 
+    def _modify_chunk(self, data):
+        """Modify and select the data received in a single response."""
+        modifier = ApiDataModifier(data, self.__modifications)
+        modifier.make_modifications()
+        if self.__selection:
+            data = self._select_data(data=data)
+        return data
+
     def _select_data(self, data):
         """Select data to be saved in the database."""
         return [data_dict for data_dict in data if
@@ -215,115 +290,135 @@ class HistoricalCollector:
     __api_url = settings.HISTORICAL_URL
     __modifications = settings.HISTORICAL_MODIFICATIONS
 
-    def __init__(self, db, currency, start_date, end_date):
+    def __init__(self, db, currency, start_date, end_date, session=None):
         self.__db = db
         self.__currency = currency
         self.__start_date = start_date
         self.__end_date = end_date
+        self.__session = session
 
-    def get_data(self):
-        """Gather the requested data from the db or the API."""
-        c, error = self._get_cryptocurrency()
-        if c is None:
-            return None, error
+    def get_data(self, columns=None):
+        """Gather the requested data from the db or the API.
 
+        If columns are given, return tuples with only their values
+        instead of model instances.
+        """
+        stored_dates = None
         with self.__db:
-            db_data = self._get_historical_values(c)
-        entries_required = self._count_days()
-        if len(db_data) == entries_required:
-            return db_data, None
+            c = Cryptocurrency.get_or_none(currency_name=self.__currency)
+            # Fetch the stored dates only if some of them are missing
+            if c is not None and self._get_historical_values(
+                    c).count() != self._days_count:
+                stored_dates = [row[0] for row in self._get_historical_values(
+                    c, columns=[self.__column])]
 
-        new_data, error = self._get_missing_data(c, db_data, entries_required)
-        if new_data is None:
-            return None, error
+        if c is None:
+            c, error = self._download_cryptocurrency()
+            if c is None:
+                return None, error
+            # A newly added cryptocurrency has no historical values yet
+            stored_dates = []
 
-        with self.__db:
-            complete_data = self._get_historical_values(c)
-        return complete_data, error
+        if stored_dates is not None:
+            new_data, error = self._get_missing_data(c, stored_dates)
+            if new_data is None:
+                return None, error
 
-    def _get_cryptocurrency(self):
-        """Get cryptocurrency from the database or the API."""
-        error = None
         with self.__db:
-            c = Cryptocurrency.get_or_none(currency_name=self.__currency)
-        if c is not None:
-            return c, error
+            complete_data = list(self._get_historical_values(c, columns))
+        return complete_data, None
 
+    def _download_cryptocurrency(self):
+        """Download the cryptocurrency from the API and save it."""
         url = settings.CRYPTOCURRENCY_URL.safe_substitute(
             currency=self.__currency)
         parameters = (None,)
         modifications = settings.CRYPTOCURRENCY_MODIFICATIONS
         worker = ApiWorker(self.__db, url, parameters, modifications,
-                           'Cryptocurrency', foreign_keys=None)
-        data, error = worker.data_one_to_many_or_no_relationship()
-        if error is None:
-            data = data[0]
-        else:
-            if '404 Client Error' in error:
-                error += ("\n\nMake sure you have entered the correct"
-                          " cryptocurrency ID")
+                           'Cryptocurrency', foreign_keys=None,
+                           session=self.__session)
+        with connection(self.__db):
+            data, error = worker.data_one_to_many_or_no_relationship()
+            if error is None:
+                data = Cryptocurrency.get_by_id(data[0])
+        if error is not None and '404 Client Error' in error:
+            error += ("\n\nMake sure you have entered the correct"
+                      " cryptocurrency ID")
         return data, error
 
-    def _get_missing_data(self, c, db_data, entries_required):
+    def _get_missing_data(self, c, stored_dates):
         """Download missing historical data from the api."""
-        parameters = self._requests_parameters(entries_required,
+        reject_values = frozenset(stored_dates)
+        parameters = self._requests_parameters(reject_values,
                                                settings.ROWS_LIMIT)
-        reject_values = [to_string(day) for day in
-                         list_values(db_data, self.__column)]
         url = self.__api_url.safe_substitute(coin=self.__currency)
         worker = ApiWorker(
             self.__db, url, parameters, self.__modifications, self.__table,
-            {'currency': c}, self.__column, reject_values
+            {'currency': c}, self.__column, reject_values, self.__session
         )
-        new_data, error = worker.data_one_to_many_or_no_relationship()
+        with connection(self.__db), \
+                pragmas(self.__db, settings.BULK_INSERT_PRAGMAS):
+            new_data, error = worker.data_one_to_many_or_no_relationship()
         return new_data, error
 
-    def _get_historical_values(self, cryptocurrency):
+    def _get_historical_values(self, cryptocurrency, columns=None):
         """Download historical values from the database."""
         db_data = HistoricalValue.get_data_in_range(
             self.__column, self.__start_date, self.__end_date,
-            condition={'column': 'currency', 'value': cryptocurrency})
+            condition={'column': 'currency', 'value': cryptocurrency},
+            columns=columns)
         return db_data
 
-    def _count_days(self):
+    @cached_property
+    def _days_count(self):
         """Count days between start and end dates inclusively."""
         delta = self.__end_date - self.__start_date
         return delta.days + 1
 
-    def _date_range(self, days):
-        """Get a list of dates for which data are needed."""
-        dates = []
-        start = self.__start_date
-        for i in range(days):
-            day = start + timedelta(days=i)
-            dates.append(to_string(day))
-        return dates
+    def _requests_parameters(self, stored_dates, limit):
+        """Prepare query parameters for requests sent to the API.
 
-    def _requests_parameters(self, entries_required, limit):
-        """Prepare query parameters for requests sent to the API."""
-        if entries_required < limit:
-            return {'start': to_string(self.__start_date),
-                    'end': to_string(self.__end_date)},
+        Only the days missing from stored_dates are requested, in windows
+        of consecutive days no longer than limit.
+        """
+        start = self.__start_date.date()
+        window_start = None
+        for offset in range(self._days_count):
+            day = start + timedelta(days=offset)
+            if day in stored_dates:
+                if window_start is not None:
+                    yield self._window(window_start, day - timedelta(days=1))
+                    window_start = None
+            elif window_start is None:
+                window_start = day
+            elif (day - window_start).days == limit:
+                yield self._window(window_start, day - timedelta(days=1))
+                window_start = day
+        if window_start is not None:
+            yield self._window(window_start, day)
 
-        date_range = self._date_range(entries_required)
-        split_dates = [date_range[i * limit:(i + 1) * limit] for i in
-                       range((len(date_range) + limit - 1) // limit)]
-        return ({'start': i[0], 'end': i[-1]} for i in split_dates)
+    @staticmethod
+    def _window(first_day, last_day):
+        """Prepare query parameters for a single window of days."""
+        return {'start': to_string(first_day), 'end': to_string(last_day)}
 
 
 class HistoricalFunctions:
-    """Perform calculations or actions as required by cli commands."""
+    """Perform calculations or actions as required by cli commands.
+
+    Historical data are a sequence of (date, price) tuples.
+    """
 
-    def __init__(self, historical_data, price_column):
+    def __init__(self, historical_data):
         self.__historical_data = historical_data
-        self.__price_column = price_column
 
     def longest_growth_period(self):
         """Find longest consecutive periods with increasing price."""
 
         if len(self.__historical_data) < 2:
             return None
-        prices = list_values(self.__historical_data, self.__price_column)
+        # Floats are enough to compare prices, Decimals are kept for display
+        prices = [float(price) for _, price in self.__historical_data]
         local_max, local_min = self._find_local_max_min(prices)
 
         # Discard first element if local maximum
@@ -357,11 +452,12 @@ class HistoricalFunctions:
         elif data[0] < data[1]:
             local_min.append(0)
 
-        # Iterate through middle of tle list
-        for i in range(1, n - 1):
-            if data[i - 1] > data[i] < data[i + 1]:
+        # Iterate through middle of the list, comparing neighbours pairwise
+        neighbours = zip(data, data[1:], data[2:])
+        for i, (previous, current, following) in enumerate(neighbours, 1):
+            if previous > current < following:
                 local_min.append(i)
-            elif data[i - 1] < data[i] > data[i + 1]:
+            elif previous < current > following:
                 local_max.append(i)
 
         # Last element on list
@@ -379,40 +475,40 @@ class HistoricalFunctions:
 
     def period_details(self, period):
         """Get information about the selected period."""
-        start, end = period
-        d = self._difference((getattr(start, self.__price_column),
-                              getattr(end, self.__price_column)))
+        (start_date, start_price), (end_date, end_price) = period
+        d = self._difference((start_price, end_price))
         if d >= 0.01:
             d = d.quantize(Decimal('0.01'))
-        return start.date, end.date, d
+        return start_date, end_date, d
 
     def average_price(self):
         """Calculate the average price for each month."""
-        grouped_by_months = self._group_by_months()
         result = []
-        for data in grouped_by_months:
-            prices = list_values(data, self.__price_column)
-            average = mean(prices)
+        for first_day, group in self._group_by_months():
+            total = count = 0
+            for _, price in group:
+                total += price
+                count += 1
+            average = total / count
             if average >= 0.01:
                 average = average.quantize(Decimal('0.01'))
-            date = to_string(data[0].date, '%Y-%m')
-            result.append((date, average))
+            else:
+                # Divide the reduced fraction, as statistics.mean does, so
+                # trailing zeros of the prices are not kept in the result
+                exact = Fraction(total) / count
+                average = Decimal(exact.numerator) / exact.denominator
+            result.append((to_string(first_day, '%Y-%m'), average))
         return result
 
     def _group_by_months(self):
-        """Group historical data by month."""
-        result = []
-        month = self.__historical_data[0].date.month
-        start_index = 0
-        for index, record in enumerate(self.__historical_data):
-            if record.date.month == month:
-                continue
-            result.append(self.__historical_data[start_index:index])
-            start_index = index
-            month = record.date.month
-        else:
-            result.append(self.__historical_data[start_index:])
-        return result
+        """Group historical data by month.
+
+        Yield the first day of each month with an iterator over its rows.
+        """
+        for (year, month), group in groupby(
+                self.__historical_data,
+                key=lambda row: (row[0].year, row[0].month)):
+            yield datetime(year, month, 1), group
 
     def export_fo_file(self, name, format_):
         """Export historical data to the file in the given format."""
@@ -422,37 +518,97 @@ class HistoricalFunctions:
             sys.exit(f'Unable to save to {format_} file. Unknown format.')
         func = getattr(self, method)
         filename = name + '.' + format_
-        data = [i.to_file(self.__price_column) for i in self.__historical_data]
+        data = [self._to_file(row) for row in self.__historical_data]
         func(data, filename)
         return filename
 
+    @staticmethod
+    def _to_file(row, precision=2):
+        """Prepare a (date, price) tuple with the row data."""
+        date, price = row
+        return str(date), round(float(price), precision)
+
     @staticmethod
     def _save_as_json(data, filename):
-        """Save the data as json file."""
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
+        """Save the data as json file, using orjson when available."""
+        data = [{'date': date, 'price': price} for date, price in data]
+        if orjson is not None:
+            with open(filename, 'wb') as file:
+                file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filename, 'w') as file:
+                json.dump(data, file, indent=2)
 
     @staticmethod
     def _save_as_csv(data, filename):
         """Save the data as csv file."""
-        with open(filename, 'w') as file:
-            headers = ['date', 'price']
-            writer = csv.DictWriter(file, fieldnames=headers, delimiter=',')
-            writer.writerow({'date': 'Date', 'price': 'Price ($)'})
-            for dict_ in data:
-                writer.writerow(dict_)
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=',')
+            writer.writerow(('Date', 'Price ($)'))
+            writer.writerows(data)
+
+
+@lru_cache(maxsize=None)
+def _resolve_model(models_file, table):
+    """Return the model class of the given table."""
+    return getattr(import_module(models_file), table)
 
 
-def list_values(container, attribute):
-    """List the values of the selected attribute for all objects."""
-    return [getattr(object_, attribute) for object_ in container]
+@lru_cache(maxsize=4096)
+def _to_date(date_string, format_):
+    """Return the date parsed from the string, None if it is invalid."""
+    try:
+        return to_datetime(date_string, format_).date()
+    except (ValueError, TypeError):
+        return None
+
+
+def create_session(pool_connections=10, pool_maxsize=20, retries=3):
+    """Create a session with an enlarged and retrying connection pool."""
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=Retry(total=retries, backoff_factor=0.2))
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 def to_datetime(value, format_='%Y-%m-%d'):
     """Convert datetime object to a string."""
+    parser = _FAST_PARSERS.get(format_)
+    if parser is not None:
+        parsed = parser(value)
+        if parsed is not None:
+            return parsed
     return datetime.strptime(value, format_)
 
 
+def _parse_ymd(value):
+    """Parse a YYYY-MM-DD string without strptime, None if not possible."""
+    if len(value) == 10 and value[4] == value[7] == '-':
+        year, month, day = value[:4], value[5:7], value[8:]
+        if (year + month + day).isdigit():
+            return datetime(int(year), int(month), int(day))
+    return None
+
+
+def _parse_iso(value):
+    """Parse a YYYY-MM-DDTHH:MM:SSZ string without strptime, or None."""
+    if (len(value) == 20 and value[10] == 'T' and value[19] == 'Z'
+            and value[13] == value[16] == ':'):
+        date = _parse_ymd(value[:10])
+        hour, minute, second = value[11:13], value[14:16], value[17:19]
+        if date is not None and (hour + minute + second).isdigit():
+            return date.replace(hour=int(hour), minute=int(minute),
+                                second=int(second))
+    return None
+
+
+# Formats parsed by slicing, any other format is handled by strptime
+_FAST_PARSERS = {'%Y-%m-%d': _parse_ymd, '%Y-%m-%dT%H:%M:%SZ': _parse_iso}
+
+
 def to_string(value, format_='%Y-%m-%d'):
     """Convert string to a datetime object."""
     return datetime.strftime(value, format_)
@@ -473,9 +629,11 @@ def historical_functions(cli_function):
     def wrapper(ctx, **kwargs):
         """Gather required data and pass them to a CLI function."""
         db = DatabaseConnection.connect()
-        c = HistoricalCollector(db, ctx.obj['coin'], ctx.obj['start_date'],
-                                ctx.obj['end_date'])
-        data, error = c.get_data()
+        with create_session() as session:
+            c = HistoricalCollector(db, ctx.obj['coin'],
+                                    ctx.obj['start_date'],
+                                    ctx.obj['end_date'], session)
+            data, error = c.get_data(columns=['date', ctx.obj['ohlc']])
 
         if error is not None:
             sys.exit(error_message.safe_substitute({'error': error}))
@@ -486,7 +644,7 @@ def historical_functions(cli_function):
                  'end': to_string(ctx.obj['end_date']),
                  'coin': ctx.obj['coin']}))
 
-        h = HistoricalFunctions(data, ctx.obj['ohlc'])
+        h = HistoricalFunctions(data)
 
         cli_function(h, ctx, data, **kwargs)
 
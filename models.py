@@ -12,15 +12,24 @@ class BaseModel(Model):
         database = db
 
     @classmethod
-    def get_data_in_range(cls, column, lower, upper, condition=None):
-        """Return data within the given range."""
+    def get_data_in_range(cls, column, lower, upper, condition=None,
+                          columns=None):
+        """Return data within the given range.
+
+        If columns are given, only their values are selected and returned
+        as tuples instead of model instances.
+        """
         attr = getattr(cls, column)
+        if columns:
+            query = cls.select(*[getattr(cls, c) for c in columns]).tuples()
+        else:
+            query = cls.select()
         if condition:
             cond_attr = getattr(cls, condition['column'])
-            return cls.select().where(
+            return query.where(
                 (cond_attr == condition['value']) &
                 (attr.between(lower, upper))).order_by(attr)
-        return cls.select().where(attr.between(lower, upper)).order_by(attr)
+        return query.where(attr.between(lower, upper)).order_by(attr)
 
 
 class Cryptocurrency(BaseModel):
@@ -35,14 +44,13 @@ class HistoricalValue(BaseModel):
     close = DecimalField(max_digits=10, decimal_places=4)
     high = DecimalField(max_digits=10, decimal_places=4)
     low = DecimalField(max_digits=10, decimal_places=4)
+    # The unique (currency, date) index also serves lookups by currency
     currency = ForeignKeyField(Cryptocurrency, backref='historical_values',
-                               on_delete='CASCADE')
+                               on_delete='CASCADE', index=False)
 
-    def to_file(self, price_column, precision=2):
-        """Prepare a dictionary with object data."""
-        price = getattr(self, price_column)
-        return {'date': str(self.date),
-                'price': round(float(price), precision)}
+    class Meta:
+        # One value per currency and day, serves the date range queries
+        indexes = ((('currency', 'date'), True),)
 
 
 # Initialize database and create tables
@@ -11,6 +11,24 @@ DATABASE = {
     }
 }
 
+# Maximum number of variables in one SQLite statement (limits bulk inserts)
+SQLITE_MAX_VARIABLES = 999
+
+# Pragmas applied while downloaded historical values are being saved.
+# They trade durability for speed: with synchronous off, an operating
+# system crash or power loss during the save can corrupt the database
+# file, whichever journal mode is used. It would then have to be
+# recreated and the data downloaded again. If only the program itself
+# is interrupted, the database stays intact.
+# The journal mode is left unchanged, since leaving WAL mode requires
+# exclusive access to the database file.
+BULK_INSERT_PRAGMAS = {
+    'synchronous': 'off',
+    'foreign_keys': 'off',
+    'temp_store': 'memory',
+    'cache_size': -65536,
+}
+
 
 # API
 # Endpoint for historical OHLC
@@ -23,6 +41,9 @@ CRYPTOCURRENCY_URL = Template('https://api.coinpaprika.com/v1/coins/$currency')
 # Maximum number of rows in one request (due to API limit)
 ROWS_LIMIT = 360
 
+# Maximum number of requests sent to the API at the same time
+CONCURRENT_REQUESTS = 8
+
 
 # API DATA MODIFICATIONS
 # Configuration of the modifications to be performed on API data before
@@ -31,8 +52,8 @@ ROWS_LIMIT = 360
 # Modifications for HistoricalValue model
 HISTORICAL_MODIFICATIONS = (
     {
-        'function': '_format_date',
-        'args': ('time_close', 'date', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d')
+        'function': '_parse_date',
+        'args': ('time_close', 'date', '%Y-%m-%dT%H:%M:%SZ')
     },
 )
 
@@ -1,23 +1,39 @@
+from datetime import date, datetime
 import json
+import mmap
 import os
 import re
+import time
 
+import click
 from click.testing import CliRunner
-from peewee import SqliteDatabase
 import pytest
+import requests
 
+from db_connection import DatabaseConnection
 from historical import cli
+from functions import ApiDataDownloader, ApiDataModifier, \
+    HistoricalCollector
 from models import Cryptocurrency, HistoricalValue
-from functions import ApiDataDownloader, ApiDataModifier
 import settings
+from validation import last_day, parse_date
 
-MODELS = [Cryptocurrency, HistoricalValue]
-TEST_DATA_FILE = 't_data.json'
+# Patterns used to count dates in the commands output
+DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+MONTH_RE = re.compile(r'\d{4}-\d{2}')
+# Periods and increases found by the consecutive-increase command
+PERIODS_RE = re.compile(r'from \d{4}-\d{2}-\d{2} to \d{4}-\d{2}-\d{2}'
+                        r'|\$\d+\.\d{2}')
+# First row of the exported csv file, comma delimited
+CSV_ROW_RE = re.compile(rb'2020-01-01,7220\.19\r\n')
 
-# SQLite database for tests
-db = SqliteDatabase(':memory:')
 
+@pytest.fixture(scope='module')
+def runner():
+    return CliRunner(mix_stderr=False)
 
+
+@pytest.mark.usefixtures('transaction', 'tmp_cwd')
 class TestHistoricalCommands:
     """Test CLI historical commands."""
 
@@ -26,71 +42,40 @@ class TestHistoricalCommands:
     increase_error = 'Incorrect increase value calculated'
     period_error = 'Incorrect consecutive period found'
 
-    @classmethod
-    def setup_class(cls):
-        """Set up the database and add testing data."""
-        db.bind(MODELS, bind_refs=False, bind_backrefs=False)
-        db.connect()
-        db.create_tables(MODELS)
-
-        try:
-            with open(TEST_DATA_FILE, 'r') as f:
-                data = json.load(f)
-                c = Cryptocurrency.create(currency_name='btc-bitcoin')
-                for elem in data:
-                    elem['currency'] = c
-                    HistoricalValue.create(**elem)
-        except FileNotFoundError:
-            pytest.exit(f'{TEST_DATA_FILE} file is missing')
-
-    @classmethod
-    def teardown_class(cls):
-        """Disconnect from the database. Delete temporary test files."""
-        db.drop_tables(MODELS)
-        db.close()
-
-        for file in ['test.csv', 'test.json', 'test_name.csv']:
-            try:
-                os.remove(file)
-            except FileNotFoundError:
-                pass
-
-    def test_consecutive_increase_single_result(self):
+    def test_consecutive_increase_single_result(self, runner):
         """Test consecutive-increase command, single period found."""
-        runner = CliRunner()
         args = ['--start-date', '2020-01-01', '--end-date', '2020-01-31',
                 'consecutive-increase']
         result = runner.invoke(cli, args=args, obj={})
         o = result.output
         assert result.exit_code == 0, self.code_error
         assert 'from 2020-01-25 to 2020-01-28' in o, self.period_error
-        assert len(re.findall(r'\d{4}-\d{2}-\d{2}', o)) == 2, self.period_error
+        assert len(DATE_RE.findall(o)) == 2, self.period_error
         assert '$966.27' in o, self.increase_error
         assert 'Longest consecutive period was' in o, self.description_error
 
-    def test_consecutive_increase_multiple_results(self):
+    def test_consecutive_increase_multiple_results(self, runner):
         """Test consecutive-increase command, many periods found."""
-        runner = CliRunner()
         args = ['--start-date', '2020-01-01', '--end-date', '2020-01-20',
                 'consecutive-increase']
         result = runner.invoke(cli, args=args, obj={})
         o = result.output
         assert result.exit_code == 0, self.code_error
-        for period in ['from 2020-01-02 to 2020-01-04',
-                       'from 2020-01-05 to 2020-01-07',
-                       'from 2020-01-16 to 2020-01-18']:
-            assert period in o, self.period_error
-        assert len(re.findall(r'\d{4}-\d{2}-\d{2}', o)) == 6, self.period_error
-        for value in ['$383.57', '$804.65', '$218.37']:
-            assert value in o, self.increase_error
+        periods = {'from 2020-01-02 to 2020-01-04',
+                   'from 2020-01-05 to 2020-01-07',
+                   'from 2020-01-16 to 2020-01-18'}
+        values = {'$383.57', '$804.65', '$218.37'}
+        found = set(PERIODS_RE.findall(o))
+        assert periods <= found, self.period_error
+        assert len(DATE_RE.findall(o)) == 6, self.period_error
+        assert values <= found, self.increase_error
         assert 'More than one consecutive period' in o, self.description_error
 
-    def test_month_average_price(self):
+    def test_month_average_price(self, runner):
         """Test average-price-by-month command."""
         average_error = 'Incorrect average value calculated'
         month_error = 'Average value calculated for wrong month'
 
-        runner = CliRunner()
         args = ['--start-date', '2020-01', '--end-date', '2020-03',
                 'average-price-by-month']
         result = runner.invoke(cli, args=args, obj={})
@@ -100,36 +85,50 @@ class TestHistoricalCommands:
             assert value in o, average_error
         for month in ['2020-01', '2020-02', '2020-03']:
             assert month in o, month_error
-        assert len(re.findall(r'\d{4}-\d{2}', o)) == 3, (
+        assert len(MONTH_RE.findall(o)) == 3, (
             'Calculated more average values than expected')
         assert 'Date' in o, self.description_error
         assert 'Average price ($)' in o, self.description_error
 
-    def test_export_csv(self):
+    def test_month_average_price_below_cent(self, runner):
+        """Test average-price-by-month command, average below one cent."""
+        c = Cryptocurrency.create(currency_name='tiny-coin')
+        HistoricalValue.insert_many(
+            [{'date': date(2020, 4, day), 'currency': c,
+              'open': price, 'close': price, 'high': price, 'low': price}
+             for day, price in zip(range(1, 31), [0.0015, 0.0025] * 15)]
+        ).execute()
+
+        args = ['--start-date', '2020-04', '--end-date', '2020-04',
+                '--coin', 'tiny-coin', 'average-price-by-month']
+        result = runner.invoke(cli, args=args, obj={})
+        assert result.exit_code == 0, self.code_error
+        assert '2020-04    0.002\n' in result.output, (
+            'Incorrect average value calculated')
+
+    def test_export_csv(self, runner):
         """Test export command, export to the csv file."""
         file_content_error = 'Incorrect file content'
-        runner = CliRunner()
         args = ['--start-date', '2020-01-01', '--end-date', '2020-01-31',
                 'export', '--format', 'csv', '--file', 'test']
-        result = runner.invoke(cli, args=args, obj={})
+        result = runner.invoke(cli, args=args, obj={},
+                               catch_exceptions=False)
         assert result.exit_code == 0, self.code_error
         try:
-            with open('test.csv', 'r') as f:
-                first_line = f.readline()
-                assert first_line == 'Date,Price ($)\n', 'Incorrect fieldnames'
-                next_line = f.readline()
-                assert '2020-01-01' in next_line, file_content_error
-                assert '7220.19' in next_line, file_content_error
-                assert ',' in next_line, 'Incorrect delimiter'
+            with open('test.csv', 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                header = b'Date,Price ($)\r\n'
+                assert m[:len(header)] == header, 'Incorrect fieldnames'
+                assert CSV_ROW_RE.match(m, len(header)), file_content_error
         except FileNotFoundError:
             raise AssertionError("File not created")
 
-    def test_export_json(self):
+    def test_export_json(self, runner):
         """Test export command, export to the json file."""
-        runner = CliRunner()
         args = ['--start-date', '2020-01-01', '--end-date', '2020-01-31',
                 'export', '--format', 'json', '--file', 'test']
-        result = runner.invoke(cli, args=args, obj={})
+        result = runner.invoke(cli, args=args, obj={},
+                               catch_exceptions=False)
         assert result.exit_code == 0, self.code_error
         try:
             with open('test.json', 'r') as f:
@@ -144,38 +143,202 @@ class TestHistoricalCommands:
 
     def test_export_correct_filename(self):
         """Test export command, check filename and format."""
-        runner = CliRunner()
         args = ['--start-date', '2020-01-01', '--end-date', '2020-01-2',
                 'export', '--format', 'csv', '--file', 'test_name.json']
-        result = runner.invoke(cli, args=args, obj={})
-        assert result.exit_code == 0, self.code_error
+        # The output is not checked, so the command is run without a runner
+        cli.main(args=args, obj={}, standalone_mode=False)
         assert os.path.isfile('test_name.csv'), 'Incorrect filename'
         assert not os.path.isfile('test_name.json'), 'Incorrect file format'
 
 
+@pytest.mark.usefixtures('transaction')
+class TestHistoricalCollector:
+    """Test HistoricalCollector methods."""
+
+    def test_get_data_new_cryptocurrency(self, http_session):
+        """Test collecting data of a cryptocurrency not yet in the db."""
+        collector = HistoricalCollector(
+            DatabaseConnection.connect(), 'eth-ethereum',
+            datetime(2020, 1, 1), datetime(2020, 1, 31), http_session)
+        data, error = collector.get_data(columns=['date', 'close'])
+        assert error is None, error
+        assert len(data) == 31, 'Incorrect amount of collected data'
+        c = Cryptocurrency.get_or_none(currency_name='eth-ethereum')
+        assert c is not None, 'Cryptocurrency saved to the wrong database'
+        assert c.historical_values.count() == 31, (
+            'Historical values saved to the wrong database')
+
+    def test_get_data_failed_request(self, fake_api_session, monkeypatch):
+        """Test that nothing is saved when one of the requests fails."""
+        # Request January, February and March in separate windows
+        monkeypatch.setattr(settings, 'ROWS_LIMIT', 31)
+        stored_count = HistoricalValue.select().count()
+        collector = HistoricalCollector(
+            DatabaseConnection.connect(), 'eth-ethereum',
+            datetime(2020, 1, 1), datetime(2020, 3, 31),
+            fake_api_session(failing_starts={'2020-02-01'}))
+        data, error = collector.get_data()
+        assert data is None, 'Data returned despite the failed request'
+        assert '500 Server Error' in error, 'Incorrect error'
+        assert HistoricalValue.select().count() == stored_count, (
+            'Data of the successful requests have been saved')
+
+
+class TestValidation:
+    """Test validation of CLI arguments."""
+
+    format_error = 'Incorrect date parsed'
+
+    @pytest.mark.parametrize('value, expected', [
+        ('2020-01-02', (datetime(2020, 1, 2), True)),
+        ('2020-1-2', (datetime(2020, 1, 2), True)),
+        ('2020-01', (datetime(2020, 1, 1), False)),
+        ('2020-1', (datetime(2020, 1, 1), False)),
+    ])
+    def test_parse_date(self, value, expected):
+        """Test parsing dates with one or two digit months and days."""
+        assert parse_date(value) == expected, self.format_error
+
+    @pytest.mark.parametrize('value', [
+        '2020-13', '2020-02-30', '2020-00', '2020', '20-01-01',
+        '2020-01-02x', '2020-01-', '2020-001-01',
+    ])
+    def test_parse_date_invalid(self, value):
+        """Test that invalid dates raise BadParameter."""
+        with pytest.raises(click.BadParameter):
+            parse_date(value)
+
+    @pytest.mark.parametrize('month, day', [
+        ('2019-02', 28), ('2020-02', 29), ('1900-02', 28), ('2000-02', 29),
+        ('2020-01', 31), ('2020-04', 30), ('2020-12', 31),
+    ])
+    def test_last_day(self, month, day):
+        """Test setting the last day of the month, leap years included."""
+        first_day, _ = parse_date(month)
+        assert last_day(first_day) == first_day.replace(day=day), (
+            'Incorrect last day of the month')
+
+    @pytest.mark.parametrize('args, message', [
+        (['--start-date', '2020-02-01', '--end-date', '2020-01-31'],
+         'The end date must be later than the start date!'),
+        (['--end-date', '2020-01-31', '--start-date', '2020-02-01'],
+         'The start date must be earlier than the end date!'),
+    ])
+    def test_start_date_after_end_date(self, runner, args, message):
+        """Test that a start date after the end date is rejected."""
+        result = runner.invoke(cli, args=args + ['export'], obj={})
+        assert result.exit_code == 2, 'Incorrect exit code'
+        assert message in result.stderr, 'Incorrect error message'
+
+
 @pytest.fixture
-def downloader():
+def collector():
+    return HistoricalCollector(None, 'btc-bitcoin', datetime(2020, 1, 1),
+                               datetime(2020, 1, 10))
+
+
+def days(*numbers):
+    """Return January 2020 dates with the given day numbers."""
+    return frozenset(date(2020, 1, n) for n in numbers)
+
+
+def window(first, last):
+    """Return request parameters for January 2020 days first to last."""
+    return {'start': f'2020-01-{first:02d}', 'end': f'2020-01-{last:02d}'}
+
+
+def reference_windows(stored_dates, limit):
+    """Build the expected windows day by day, for comparison."""
+    windows = []
+    previous = None
+    for n in range(1, 11):
+        if date(2020, 1, n) in stored_dates:
+            continue
+        current = windows[-1] if windows else None
+        if (current and previous == n - 1
+                and current[1] - current[0] + 1 < limit):
+            current[1] = n
+        else:
+            windows.append([n, n])
+        previous = n
+    return [window(first, last) for first, last in windows]
+
+
+class TestRequestsParameters:
+    """Test windows of the missing days requested by HistoricalCollector."""
+
+    window_error = 'Incorrect windows of missing days'
+
+    def test_all_days_stored(self, collector):
+        """Test that no request is sent when every day is stored."""
+        stored = days(*range(1, 11))
+        windows = list(collector._requests_parameters(stored, 4))
+        assert windows == [], self.window_error
+
+    def test_no_days_stored(self, collector):
+        """Test that the whole range is requested when nothing is stored."""
+        windows = list(collector._requests_parameters(frozenset(), 10))
+        assert windows == [window(1, 10)], self.window_error
+
+    def test_leading_and_trailing_gaps(self, collector):
+        """Test missing days at the beginning and the end of the range."""
+        windows = list(collector._requests_parameters(days(4, 5, 6, 7), 10))
+        assert windows == [window(1, 3), window(8, 10)], self.window_error
+
+    def test_gap_longer_than_limit(self, collector):
+        """Test that a long gap is split every limit days."""
+        windows = list(collector._requests_parameters(days(1), 4))
+        assert windows == [window(2, 5), window(6, 9), window(10, 10)], (
+            self.window_error)
+
+    def test_gap_of_exactly_limit_days(self, collector):
+        """Test that a gap of exactly limit days is a single window."""
+        windows = list(collector._requests_parameters(days(1, 6, 7), 4))
+        assert windows == [window(2, 5), window(8, 10)], self.window_error
+
+    def test_isolated_single_days(self, collector):
+        """Test single missing days between the stored ones."""
+        stored = days(1, 3, 4, 6, 7, 8, 10)
+        windows = list(collector._requests_parameters(stored, 4))
+        assert windows == [window(2, 2), window(5, 5), window(9, 9)], (
+            self.window_error)
+
+    @pytest.mark.parametrize('limit', [1, 2, 3, 10])
+    def test_every_stored_combination(self, collector, limit):
+        """Compare windows for every set of stored days with a reference."""
+        for mask in range(2 ** 10):
+            stored = days(*(n for n in range(1, 11) if mask >> (n - 1) & 1))
+            windows = list(collector._requests_parameters(stored, limit))
+            assert windows == reference_windows(stored, limit), (
+                f'{self.window_error} for stored days {sorted(stored)}')
+
+
+@pytest.fixture
+def downloader(http_session):
     parameters = ({'start': '2020-01-01', 'end': '2020-01-31'},)
     url = settings.HISTORICAL_URL.safe_substitute(coin='btc-bitcoin')
-    downloader = ApiDataDownloader(url, parameters, 10)
+    downloader = ApiDataDownloader(url, parameters, 10,
+                                   session=http_session)
     return downloader
 
 
 @pytest.fixture
-def downloader_second():
+def downloader_second(http_session):
     parameters = ({'start': '2020-01-01', 'end': '2020-01-31'},
                   {'start': '2020-02-01', 'end': '2020-02-28'},
                   {'start': '2020-03-01', 'end': '2020-03-31'})
     url = settings.HISTORICAL_URL.safe_substitute(coin='btc-bitcoin')
-    downloader = ApiDataDownloader(url, parameters, 10)
+    downloader = ApiDataDownloader(url, parameters, 10,
+                                   session=http_session)
     return downloader
 
 
 @pytest.fixture
-def downloader_third():
+def downloader_third(http_session):
     parameters = (None,)
     url = settings.CRYPTOCURRENCY_URL.safe_substitute(currency='btc-bitcoin')
-    downloader = ApiDataDownloader(url, parameters, 10)
+    downloader = ApiDataDownloader(url, parameters, 10,
+                                   session=http_session)
     return downloader
 
 
@@ -188,26 +351,53 @@ class TestApiDataDownloader:
     def test_get_data_single_request(self, downloader):
         """Test downloading historical data with single request."""
         downloader.get_data()
-        if downloader.error is None:
-            assert downloader.data is not None, self.no_data_error
-            assert len(downloader.data) == 31, self.amount_error
+        assert downloader.error is None, downloader.error
+        assert downloader.data is not None, self.no_data_error
+        assert len(downloader.data) == 31, self.amount_error
 
     def test_get_data_multiple_requests(self, downloader_second):
         """Test downloading historical data with multiple requests."""
         downloader_second.get_data()
-        if downloader_second.error is None:
-            assert downloader_second.data is not None, self.no_data_error
-            assert len(downloader_second.data) == 90, self.amount_error
+        assert downloader_second.error is None, downloader_second.error
+        assert downloader_second.data is not None, self.no_data_error
+        assert len(downloader_second.data) == 90, self.amount_error
 
     def test_get_data_cryptocurrency(self, downloader_third):
         """Test downloading cryptocurrency data."""
         coin_error = 'Data collected for the wrong currency'
 
         downloader_third.get_data()
-        if downloader_third.error is None:
-            assert downloader_third.data is not None, self.no_data_error
-            assert len(downloader_third.data) == 1, self.amount_error
-            assert downloader_third.data[0]['id'] == 'btc-bitcoin', coin_error
+        assert downloader_third.error is None, downloader_third.error
+        assert downloader_third.data is not None, self.no_data_error
+        assert len(downloader_third.data) == 1, self.amount_error
+        assert downloader_third.data[0]['id'] == 'btc-bitcoin', coin_error
+
+    def test_get_data_first_failed_request(self):
+        """Test that the error of the first failed request is reported."""
+
+        class SlowSession:
+            """Fail windows 1 and 2, the later one after the first."""
+
+            delays = {0: 0, 1: 0.05, 2: 0.3, 3: 0}
+
+            def get(self, url, params, timeout):
+                window = params['window']
+                time.sleep(self.delays[window])
+                if window in (1, 2):
+                    raise requests.exceptions.ConnectionError(
+                        f'window {window}')
+                response = requests.Response()
+                response.status_code = 200
+                response._content = b'[]'
+                return response
+
+        parameters = [{'window': window} for window in range(4)]
+        downloader = ApiDataDownloader('https://api.test', parameters,
+                                       session=SlowSession())
+        downloader.get_data()
+        assert downloader.data is None, 'Data stored despite the failure'
+        assert downloader.error == 'Connection Error: window 1', (
+            'Error reported for the wrong request')
 
 
 @pytest.fixture
@@ -251,8 +441,9 @@ class TestApiDataModifier:
         key = 'date'
         for data_dict in modifier.data:
             assert key in data_dict, self.ker_error
-        for i, date in enumerate(('2019-01-01', '2019-01-02', '2019-01-03')):
-            assert modifier.data[i][key] == date, self.value_error
+        dates = (date(2019, 1, 1), date(2019, 1, 2), date(2019, 1, 3))
+        for i, day in enumerate(dates):
+            assert modifier.data[i][key] == day, self.value_error
 
     def test_make_modifications_cryptocurrency(self, modifier_currency):
         """Test making modifications on cryptocurrency data."""
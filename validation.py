@@ -1,36 +1,40 @@
-from calendar import monthrange
+from calendar import isleap
+from datetime import datetime
+import re
 
 import click
 
-from functions import to_datetime
+# Date in YYYY-MM-DD or YYYY-MM format, month and day may have one digit
+DATE_RE = re.compile(r'(\d{4})-(\d{1,2})(?:-(\d{1,2}))?')
+
+# Number of days in each month of a non-leap year
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+class DateRange:
+    """Store the dates validated so far, in whichever order given."""
+
+    __slots__ = ('start', 'end')
+
+    def __init__(self):
+        self.start = None
+        self.end = None
 
 
 def validate_start_date(ctx, param, value):
     """Validate start_date argument."""
 
     # Check that the date format is correct
-    format_match = False
-    for format_ in ('%Y-%m-%d', '%Y-%m'):
-        start_date = try_format(value, format_)
-        if start_date is not None:
-            format_match = True
-            break
-
-    # Raise error if no format matches
-    if not format_match:
-        raise click.BadParameter(
-            'Incorrect date format. Should be YYYY-MM-DD or YYYY-MM')
+    start_date, _ = parse_date(value)
 
-    # Add value to the context dictionary
-    ctx.obj['start'] = start_date
+    # Add value to the context object
+    dates = ctx.ensure_object(DateRange)
+    dates.start = start_date
 
-    # Check that the start date is before the end date
-    try:
-        if start_date > ctx.obj['end']:
-            raise click.BadParameter(
-                'The start date must be earlier than the end date!')
-    except KeyError:  # In case the user enters start_date first
-        pass
+    # Check that the start date is before the end date, if already given
+    if dates.end is not None and start_date > dates.end:
+        raise click.BadParameter(
+            'The start date must be earlier than the end date!')
 
     return start_date
 
@@ -39,54 +43,50 @@ def validate_end_date(ctx, param, value):
     """Validate end_date argument."""
 
     # Check that the date format is correct
-    format_match = False
-    modify_date = False
-    end_date = try_format(value, '%Y-%m-%d')
-    if end_date is not None:
-        format_match = True
-    else:
-        end_date = try_format(value, '%Y-%m')
-        if end_date is not None:
-            format_match = True
-            modify_date = True
-
-    # Raise error if no format matches
-    if not format_match:
-        raise click.BadParameter(
-            'Incorrect date format. Should be YYYY-MM-DD or YYYY-MM')
+    end_date, day_given = parse_date(value)
 
     # Set day to the last day of the month for format YYYY-MM
-    if modify_date:
+    if not day_given:
         end_date = last_day(end_date)
 
-    # Add value to the context dictionary
-    ctx.obj['end'] = end_date
+    # Add value to the context object
+    dates = ctx.ensure_object(DateRange)
+    dates.end = end_date
 
-    # Check that the start date is before the end date
-    try:
-        if end_date < ctx.obj['start']:
-            raise click.BadParameter(
-                'The end date must be later than the start date!')
-    except KeyError:  # In case the user enters end_date first
-        pass
+    # Check that the start date is before the end date, if already given
+    if dates.start is not None and end_date < dates.start:
+        raise click.BadParameter(
+            'The end date must be later than the start date!')
 
     return end_date
 
 
 def validate_filename(ctx, param, value):
     """Validate file argument. Return value without file format."""
-    return value.split('.')[0]
+    return value.partition('.')[0]
+
 
+def parse_date(value):
+    """Parse the date in YYYY-MM-DD or YYYY-MM format.
 
-def try_format(value, format_):
-    """Try to change type to datetime with the given format."""
+    Return the date and whether the day was given. Raise BadParameter
+    if the value has neither format or is not a valid date.
+    """
+    error = 'Incorrect date format. Should be YYYY-MM-DD or YYYY-MM'
+    match = DATE_RE.fullmatch(value)
+    if match is None:
+        raise click.BadParameter(error)
+    year, month, day = match.groups()
     try:
-        return to_datetime(value, format_)
-    except ValueError:
-        return None
+        date = datetime(int(year), int(month), int(day or 1))
+    except ValueError:  # Month or day out of range
+        raise click.BadParameter(error)
+    return date, day is not None
 
 
 def last_day(date):
     """Set the day to the last day of the month."""
-    day = monthrange(date.year, date.month)[1]
+    day = DAYS_IN_MONTH[date.month - 1]
+    if date.month == 2 and isleap(date.year):
+        day += 1
     return date.replace(day=day)